@@ -3,10 +3,11 @@ The Oracle Tools GUI for launching Maven builds based on Oracle Tools.
 """
 
 # Python modules
+import sys
 import os
 import argparse
 import subprocess
-from gooey import Gooey, GooeyParser
+import shlex
 from shutil import which
 
 # local module(s)
@@ -40,18 +41,26 @@ DB_PROXY_PASSWORD = '--db-proxy-password'
 DB_PASSWORD = '--db-password'
 FILE = '--file'
 DB_CONFIG_DIR = '--db-config-dir'
+# Gooey runs this program again with this flag added to the command line
+IGNORE_GOOEY = '--ignore-gooey'
 
 
-@Gooey(program='Get POM file',
-       show_success_modal=False,
-       show_failure_modal=True,
-       show_restart_button=True,
-       disable_progress_bar_animation=True,
-       clear_before_run=True,
-       default_size=DEFAULT_SIZE,
-       menu=MENU,
-       terminal_font_family=TERMINAL_FONT_FAMILY)
 def get_POM_file(argv):
+    # Gooey (and thus wx) is only imported when a GUI is shown, not for the command line run of Maven
+    from gooey import Gooey
+    return Gooey(program='Get POM file',
+                 show_success_modal=False,
+                 show_failure_modal=True,
+                 show_restart_button=True,
+                 disable_progress_bar_animation=True,
+                 clear_before_run=True,
+                 default_size=DEFAULT_SIZE,
+                 menu=MENU,
+                 terminal_font_family=TERMINAL_FONT_FAMILY)(_get_POM_file)(argv)
+
+
+def _get_POM_file(argv):
+    from gooey import GooeyParser
     logger.debug('get_POM_file(%s)' % (argv))
     parser = GooeyParser(description='Get a Maven POM file to work with')
     parser.add_argument(
@@ -61,7 +70,7 @@ def get_POM_file(argv):
         widget="FileChooser",
         gooey_options={
             'validator': {
-                'test': "user_input[-7:] == 'pom.xml'",
+                'test': "user_input.endswith('pom.xml')",
                 'message': 'This is not a POM file'
             }
         })
@@ -76,17 +85,22 @@ def get_POM_file(argv):
     return args
 
 
-@Gooey(program='Run POM file',
-       show_success_modal=True,
-       show_failure_modal=True,
-       show_restart_button=True,
-       disable_progress_bar_animation=False,
-       clear_before_run=True,
-       required_cols=3,
-       default_size=DEFAULT_SIZE,
-       menu=MENU,
-       terminal_font_family=TERMINAL_FONT_FAMILY)
 def run_POM_file_gui(pom_file, db_config_dir):
+    from gooey import Gooey
+    return Gooey(program='Run POM file',
+                 show_success_modal=True,
+                 show_failure_modal=True,
+                 show_restart_button=True,
+                 disable_progress_bar_animation=False,
+                 clear_before_run=True,
+                 required_cols=3,
+                 default_size=DEFAULT_SIZE,
+                 menu=MENU,
+                 terminal_font_family=TERMINAL_FONT_FAMILY)(_run_POM_file_gui)(pom_file, db_config_dir)
+
+
+def _run_POM_file_gui(pom_file, db_config_dir):
+    from gooey import GooeyParser
     logger.debug('run_POM_file_gui(%s)' % (pom_file))
 
     db_config_dir, dbs, profiles, db_proxy_username, db_username = process_POM(pom_file, db_config_dir)
@@ -114,7 +128,7 @@ def run_POM_file_gui(pom_file, db_config_dir):
         default=pom_file,
         gooey_options={
             'validator': {
-                'test': "hash(user_input) == {}".format(hash(pom_file)),
+                'test': f"user_input == {pom_file!r}",
                 'message': 'Did you change the POM file?'
             }
         },
@@ -126,7 +140,7 @@ def run_POM_file_gui(pom_file, db_config_dir):
         default=db_config_dir,
         gooey_options={
             'validator': {
-                'test': "hash(user_input) == {}".format(hash(db_config_dir)),
+                'test': f"user_input == {db_config_dir!r}",
                 'message': 'Did you change the database configuration directory?'
             }
         },
@@ -138,6 +152,17 @@ def run_POM_file_gui(pom_file, db_config_dir):
     logger.debug('return')
 
 
+def split_options(options):
+    """
+    Split command line options like a shell does: quotes are removed but backslashes (Windows paths) are kept.
+    """
+    lexer = shlex.shlex(options, posix=True)
+    lexer.whitespace_split = True
+    lexer.escape = ''
+    lexer.commenters = ''
+    return list(lexer)
+
+
 def run_POM_file(argv):
     logger.debug('run_POM_file(%s)' % (argv))
     parser = argparse.ArgumentParser(description='Get the POM settings to work with and run the POM file')
@@ -156,19 +181,20 @@ def run_POM_file(argv):
         extra_maven_command_line_options.remove(EXTRA_MAVEN_COMMAND_LINE_OPTIONS)
     except Exception:
         pass
-    cmd = 'mvn {0} {1} -P{2} -Ddb.config.dir={3} -Ddb={4}'.format(FILE, args.file, args.action, args.db_config_dir, args.db)
-    if len(extra_maven_command_line_options) > 0:
-        cmd += ' ' + ' '.join(extra_maven_command_line_options)
+    cmd = [which('mvn') or 'mvn', FILE, args.file, f'-P{args.action}', f'-Ddb.config.dir={args.db_config_dir}', f'-Ddb={args.db}']
+    # Gooey passes the extra options as one string so split them like the shell did before
+    for option in extra_maven_command_line_options:
+        cmd.extend(split_options(option))
     sql_home = os.path.dirname(os.path.dirname(which('sql')))
     logger.debug('sql_home: {}'.format(sql_home))
-    cmd += f' -Dsql.home="{sql_home}"'
-    logger.info('Maven command to execute: %s' % (cmd))
+    cmd.append(f'-Dsql.home={sql_home}')
+    logger.info('Maven command to execute: %s' % (subprocess.list2cmdline(cmd)))
     # now add the password
     if args.db_proxy_password:
         os.environ['DB_PASSWORD'] = args.db_proxy_password
     elif args.db_password:
         os.environ['DB_PASSWORD'] = args.db_password
-    subprocess.run(cmd, check=True, shell=True)
+    subprocess.run(cmd, check=True)
     os.environ['DB_PASSWORD'] = ''
     logger.debug('return')
 
@@ -176,6 +202,10 @@ def run_POM_file(argv):
 def main():
     global logger
 
+    # Gooey is imported lazily so its decorator can not remove this flag before initialize() reads sys.argv:
+    # remove it here and let the Gooey decorators show their GUI.
+    if IGNORE_GOOEY in sys.argv:
+        sys.argv.remove(IGNORE_GOOEY)
     argv, logger, args = initialize()
     if len(argv) <= 4:
         if not args.file:
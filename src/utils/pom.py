@@ -8,11 +8,19 @@ import os
 import argparse
 import subprocess
 import re
+import json
+import hashlib
+import tempfile
+import getpass
+import stat
+import locale
 from pathlib import Path
 import logging
+import xml.etree.ElementTree as ET
 from shutil import which
-# from pkg_resources import packaging
-import pkg_resources
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from packaging.version import Version
 
 
 # items to test
@@ -21,12 +29,47 @@ __all__ = ['db_order', 'initialize', 'check_environment', 'process_POM']
 
 logger = None
 
+# Profile Id: db-install (Active: false , Source: pom)
+_PROFILE_RE = re.compile(rb"Profile Id: ([a-zA-Z0-9_.-]+) \(Active: .*, Source: pom\)")
+# [echoproperties] db.config.dir=C\:\\dev\\conf\\src
+_PROP_PREFIX = b'[echoproperties] '
 
+# <project><profiles><profile><id>, <project><properties><*> and <project><parent><relativePath>
+_POM_PROFILE_ID_PATH = ['project', 'profiles', 'profile', 'id']
+_POM_PROPERTIES_PATH = ['project', 'properties']
+_POM_PARENT_PATH = ['project', 'parent']
+_POM_PARENT_RELATIVE_PATH = ['project', 'parent', 'relativePath']
+
+# set this environment variable (to any non empty value) to ignore the cached POM settings and environment check
+NO_CACHE = 'ORACLE_TOOLS_GUI_NO_CACHE'
+_NO_CACHE_HINT = f'(set environment variable {NO_CACHE}=1 to ignore cached results)'
+
+# (program, version option, minimal version, version regex, version printed to stdout)
+_PROGRAMS = [
+    ('mvn', '-version', Version('3.3.1'), re.compile(r'Apache Maven ([0-9.]+)'), True),
+    ('perl', '--version', Version('5.16.0'), re.compile(r'\(v([0-9.]+)\)'), True),
+    ('sql', '-V', Version('18.0.0.0'), re.compile(r'SQLcl: Release ([0-9.]+)'), True),
+    ('java', '-version', Version('1.8.0'), re.compile(r'(?:java|openjdk) version "([0-9.]+).*"'), False),  # version is printed to stderr (!#$?)
+    ('javac', '-version', Version('1.8.0'), re.compile(r'javac ([0-9.]+)'), True),
+]
+
+# the actions (profiles) of an Apex or database POM in the order to show them
+_APEX_PROFILES = ('apex-export', 'apex-import')
+_APEX_SET = frozenset(_APEX_PROFILES)
+_DB_PROFILES = ('db-info', 'db-install', 'db-code-check', 'db-test', 'db-generate-ddl-full', 'db-generate-ddl-incr')
+_DB_SET = frozenset(_DB_PROFILES)
+
+# the order of the databases (DTAP) by a tag in their name
+_DB_ORDER = {'dev': 0, 'tst': 1, 'test': 2, 'acc': 3, 'prod': 4, 'prd': 5}
+_DB_ORDER_RE = re.compile('(' + '|'.join(_DB_ORDER) + ')')
+
+
+@lru_cache(maxsize=256)
 def db_order(db):
-    for i, e in enumerate(['dev', 'tst', 'test', 'acc', 'prod', 'prd']):
-        if e in db.lower():
-            return i
-    return db.lower()
+    db = db.lower()
+    m = _DB_ORDER_RE.search(db)
+    # names without a tag come last and names with the same priority are sorted alphabetically
+    return (_DB_ORDER[m.group(1)] if m else len(_DB_ORDER), db)
 
 
 def initialize():
@@ -53,27 +96,128 @@ def initialize():
     return argv, logger, args
 
 
+def _cache_dir():
+    """
+    The cache directory is private to the user since a shared one could be prepared by another user.
+    """
+    user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    cache_dir = Path(tempfile.gettempdir()) / f'oracle-tools-gui-cache-{user}'
+    cache_dir.mkdir(mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid'):
+        st = os.lstat(cache_dir)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise PermissionError(f'The cache directory {cache_dir} must be a directory owned by and only accessible to the current user')
+    return cache_dir
+
+
+def _cache_file(key):
+    return _cache_dir() / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+
+
+def _read_cache(key):
+    if os.environ.get(NO_CACHE):
+        raise OSError(f'The cache is disabled by environment variable {NO_CACHE}')
+    cache_file = _cache_file(key)
+    with open(cache_file, mode='r', encoding='utf-8') as fp:
+        data = json.load(fp)
+    logger.debug('using cache file %s' % (cache_file))
+    return data
+
+
+def _write_cache(key, data):
+    try:
+        cache_file = _cache_file(key)
+        with tempfile.NamedTemporaryFile(mode='w', encoding='utf-8', dir=cache_file.parent, suffix='.tmp', delete=False) as fp:
+            json.dump(data, fp)
+        os.replace(fp.name, cache_file)
+    except OSError as e:
+        logger.debug('could not write cache file: %s' % (e))
+
+
 def check_environment():
-    programs = [
-        ['mvn', '-version', '3.3.1', r'Apache Maven ([0-9.]+)', True],
-        ['perl', '--version', '5.16.0', r'\(v([0-9.]+)\)', True],
-        ['sql', '-V', '18.0.0.0', r'SQLcl: Release ([0-9.]+)', True],
-        ['java', '-version', '1.8.0', r'(?:java|openjdk) version "([0-9.]+).*"', False], # version is printed to stderr (!#$?)
-        ['javac', '-version', '1.8.0', r'javac ([0-9.]+)', True],
-    ]
-
-    for i, p in enumerate(programs):
-        proc = subprocess.run(p[0] + ' ' + p[1], shell=True, capture_output=True, text=True)
+    """
+    Check the versions of the programs needed.
+    A successful check is cached as long as the programs found on the PATH are not replaced,
+    so the (mostly JVM based) programs are not started on every launch.
+    """
+    locations = [which(p[0]) for p in _PROGRAMS]
+    key = None
+    if all(locations):
+        key = 'check_environment|' + '|'.join(f"{location}|{os.stat(location).st_mtime_ns}" for location in locations)
+        try:
+            versions = _read_cache(key)
+            # only a check of all the programs counts
+            if [version[0] for version in versions] == [p[0] for p in _PROGRAMS]:
+                for program, location, actual_version in versions:
+                    logger.info('Version of "{}" is "{}" and its location is "{}"'.format(program, actual_version, os.path.dirname(location)))
+                return
+        except (OSError, ValueError, TypeError, IndexError):
+            pass
+
+    def run(p):
+        # which() also finds mvn.cmd and the like on Windows
+        return p, subprocess.run([which(p[0]) or p[0], p[1]], capture_output=True, text=True)
+
+    # the programs are mostly JVM based so start them all at once
+    with ThreadPoolExecutor(max_workers=len(_PROGRAMS)) as executor:
+        procs = list(executor.map(run, _PROGRAMS))
+
+    versions = []
+    for p, proc in procs:
         assert proc.returncode == 0, proc.stderr
         logger.debug('proc: {}'.format(proc))
         expected_version = p[2]
         regex = p[3]
         output = proc.stdout if p[4] else proc.stderr
-        m = re.search(regex, output)
-        assert m, 'Could not find {} in {}'.format(regex, output)
+        m = regex.search(output)
+        assert m, 'Could not find {} in {}'.format(regex.pattern, output)
         actual_version = m.group(1)
-        assert pkg_resources.packaging.version.parse(actual_version) >= pkg_resources.packaging.version.parse(expected_version), f'Version of program "{p[0]}" is "{actual_version}" which is less than the expected version "{expected_version}"'
+        assert Version(actual_version) >= expected_version, f'Version of program "{p[0]}" is "{actual_version}" which is less than the expected version "{expected_version}"'
         logger.info('Version of "{}" is "{}" and its location is "{}"'.format(p[0], actual_version, os.path.dirname(which(p[0]))))
+        versions.append((p[0], which(p[0]), actual_version))
+
+    if key:
+        _write_cache(key, versions)
+
+
+def _determine_POM_settings(pom_file, db_config_dir):
+    """
+    Determine the profiles and properties of the POM file by running Maven.
+    """
+    properties = {}
+    profiles = set()
+
+    # The echoproperties execution of the conf-inquiry profile (Oracle Tools parent POM) needs the compile phase,
+    # but there is nothing to compile so tell the compiler plugin to skip.
+    cmd = [which('mvn') or 'mvn', '--file', str(pom_file), '-N', 'help:all-profiles', '-Pconf-inquiry', 'compile', '-Dmaven.main.skip=true']
+    if db_config_dir:
+        cmd.append(f'-Ddb.config.dir={db_config_dir}')
+    # Only the matching groups are decoded, not the (large) rest of the output
+    encoding = locale.getpreferredencoding(False)
+    # stderr goes to a temporary file so a chatty Maven can not block on a full pipe while stdout is parsed
+    with tempfile.TemporaryFile() as stderr:
+        with subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr) as mvn:
+            for line in mvn.stdout:
+                line = line.rstrip(b'\r\n')
+                if line.startswith(_PROP_PREFIX):
+                    name, eq, value = line[len(_PROP_PREFIX):].partition(b'=')
+                    if eq and name and value:
+                        name, value = name.decode('ascii', errors='replace'), value.decode(encoding, errors='replace')
+                        logger.debug("adding property %s = %s" % (name, value))
+                        properties[name] = value
+                    continue
+                m = _PROFILE_RE.search(line)
+                if m:
+                    profile = m.group(1).decode('ascii')
+                    logger.debug("adding profile: %s" % (profile))
+                    profiles.add(profile)
+
+        if mvn.returncode != 0:
+            stderr.seek(0)
+            error = stderr.read().decode(encoding, errors='replace')
+            raise Exception(f'The command "{subprocess.list2cmdline(cmd)}" failed with return code {mvn.returncode} and error:\n{error}')
+
+    return properties, profiles
 
 
 def process_POM(pom_file, db_config_dir):
@@ -81,71 +225,119 @@ def process_POM(pom_file, db_config_dir):
     Process a single POM file and setup the GUI.
     The POM file must be either based on an Oracle Tools parent POM for the database or Apex.
     """
-    def determine_POM_settings(pom_file, db_config_dir):
+    def parse_POM_settings(pom_file):
+        """
+        Parse the profiles and properties defined in the POM file itself, without Maven.
+        Inherited profiles and properties (parent POM) and interpolation are NOT taken into account.
+        The property values are escaped like echoproperties does.
+        The parent is None without a parent POM, otherwise its relative path ('' when it must be looked up in a repository).
+        """
         properties = {}
         profiles = set()
+        parent = None
+        path = []
+
+        for event, elem in ET.iterparse(pom_file, events=('start', 'end')):
+            tag = elem.tag.rpartition('}')[2]
+            if event == 'start':
+                path.append(tag)
+                continue
+            text = (elem.text or '').strip()
+            if path == _POM_PROFILE_ID_PATH:
+                if text:
+                    profiles.add(text)
+            elif len(path) == 3 and path[:2] == _POM_PROPERTIES_PATH:
+                properties[tag] = text.replace('\\', '\\\\').replace(':', '\\:')
+            elif path == _POM_PARENT_RELATIVE_PATH:
+                parent = text
+            elif path == _POM_PARENT_PATH and parent is None:
+                parent = '../pom.xml'
+            path.pop()
+            elem.clear()
+        return properties, profiles, parent
+
+    def parent_POM_file(pom_file, parent):
+        """
+        The parent POM file when it can be found on disk, else None.
+        """
+        if not parent:
+            return None
+        parent_file = os.path.join(os.path.dirname(os.path.abspath(pom_file)), parent)
+        if os.path.isdir(parent_file):
+            parent_file = os.path.join(parent_file, 'pom.xml')
+        return parent_file if os.path.isfile(parent_file) else None
 
-        cmd = f"mvn --file {pom_file} -N help:all-profiles -Pconf-inquiry compile"
-        if db_config_dir:
-            cmd += f" -Ddb.config.dir={db_config_dir}"
-        mvn = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
-        stdout, stderr = mvn.communicate()
+    def valid_POM_settings(properties, profiles):
+        """
+        Do the POM settings contain the actions (profiles) and a database account?
+        """
+        return (profiles >= _APEX_SET or profiles >= _DB_SET) and bool(properties.get('db.proxy.username') or properties.get('db.username'))
 
-        if mvn.returncode == 0:
+    def usable_POM_settings(properties, profiles, db_config_dir):
+        """
+        Are the POM settings enough to setup the GUI?
+        """
+        names = ['db.proxy.username' if 'db.proxy.username' in properties else 'db.username']
+        if not db_config_dir:
+            names.append('db.config.dir')
+        return (profiles >= _APEX_SET or profiles >= _DB_SET) and all(properties.get(name) and '${' not in properties[name] for name in names)
+
+    def cached_POM_settings(pom_file, db_config_dir):
+        """
+        Return the POM settings from the POM file itself when that is enough,
+        or from the cache as long as the POM file (and its parent POM file if found) has not been modified since,
+        otherwise determine them with Maven and store them in the cache when valid.
+        """
+        parent = None
+        try:
+            properties, profiles, parent = parse_POM_settings(pom_file)
+            # a parent POM may define (other) properties like db.proxy.username so then Maven must be used
+            if parent is None and usable_POM_settings(properties, profiles, db_config_dir):
+                logger.debug('using the POM settings from %s itself' % (pom_file))
+                return properties, profiles
+        except ET.ParseError as e:
+            logger.debug('could not parse %s: %s' % (pom_file, e))
+
+        key = f"{os.path.abspath(pom_file)}|{os.stat(pom_file).st_mtime_ns}|{db_config_dir}"
+        parent_file = parent_POM_file(pom_file, parent)
+        if parent_file:
+            key += f"|{parent_file}|{os.stat(parent_file).st_mtime_ns}"
+        try:
+            settings = _read_cache(key)
+            return settings['properties'], set(settings['profiles'])
+        except (OSError, ValueError, KeyError, TypeError):
             pass
-        else:
-            returncode = mvn.returncode
-            error = ''
-            for ch in stderr:
-                error += ch
-            raise Exception(f'The command "{cmd}" failed with return code {returncode} and error:\n{error}')
-
-        # Profile Id: db-install (Active: false , Source: pom)
-        line = ''
-        for ch in stdout:
-            if ch != "\n":
-                line += ch
-            else:
-                logger.debug("line: %s" % (line))
-                m = re.search(r"Profile Id: ([a-zA-Z0-9_.-]+) \(Active: .*, Source: pom\)", line)
-                if m:
-                    logger.debug("adding profile: %s" % (m.group(1)))
-                    profiles.add(m.group(1))
-                else:
-                    m = re.match(r'\[echoproperties\] ([a-zA-Z0-9_.-]+)=(.+)$', line)
-                    if m:
-                        logger.debug("adding property %s = %s" % (m.group(1), m.group(2)))
-                        properties[m.group(1)] = m.group(2)
-                line = ''
+
+        properties, profiles = _determine_POM_settings(pom_file, db_config_dir)
+        if valid_POM_settings(properties, profiles):
+            _write_cache(key, {'properties': properties, 'profiles': sorted(profiles)})
         return properties, profiles
 
     logger.debug('process_POM()')
-    properties, profiles = determine_POM_settings(pom_file, db_config_dir)
-    apex_profiles = ['apex-export', 'apex-import']
-    db_profiles = ['db-info', 'db-install', 'db-code-check', 'db-test', 'db-generate-ddl-full', 'db-generate-ddl-incr']
-    if profiles.issuperset(set(apex_profiles)):
-        profiles = apex_profiles
-    elif profiles.issuperset(set(db_profiles)):
-        profiles = db_profiles
+    properties, profiles = cached_POM_settings(pom_file, db_config_dir)
+    if profiles >= _APEX_SET:
+        profiles = list(_APEX_PROFILES)
+    elif profiles >= _DB_SET:
+        profiles = list(_DB_PROFILES)
     else:
-        raise Exception('Profiles (%s) must be a super set of either the Apex (%s) or database (%s) profiles' % (profiles, set(apex_profiles), set(db_profiles)))
+        raise Exception('Profiles (%s) must be a super set of either the Apex (%s) or database (%s) profiles %s' % (profiles, set(_APEX_SET), set(_DB_SET), _NO_CACHE_HINT))
     if not db_config_dir:
         # C\:\\dev\\bc\\oracle-tools\\conf\\src => C:\dev\bc\oracle-tools\conf\src =>
         db_config_dir = properties.get('db.config.dir', '').replace('\\:', ':').replace('\\\\', '\\')
-    assert db_config_dir, 'The property db.config.dir must have been set in order to choose a database (on of its subdirectories)'
+    assert db_config_dir, f'The property db.config.dir must have been set in order to choose a database (on of its subdirectories) {_NO_CACHE_HINT}'
     logger.debug('db_config_dir: ' + db_config_dir)
 
-    p = Path(db_config_dir)
     dbs = []
     try:
-        dbs = [d.name for d in filter(Path.is_dir, p.iterdir())]
+        with os.scandir(db_config_dir) as it:
+            dbs = [e.name for e in it if e.is_dir()]
     except Exception:
         pass
     assert len(dbs) > 0, 'The directory %s must have subdirectories, where each one contains information for one database (and Apex) instance' % (properties['db.config.dir'])
 
     db_proxy_username = properties.get('db.proxy.username', '')
     db_username = properties.get('db.username', '')
-    assert db_proxy_username or db_username, f'The database acount (Maven property db.proxy.username {db_proxy_username} or db.username {db_username}) must be set'
+    assert db_proxy_username or db_username, f'The database acount (Maven property db.proxy.username {db_proxy_username} or db.username {db_username}) must be set {_NO_CACHE_HINT}'
 
     logger.debug('return: (%s, %s, %s, %s, %s)' % (db_config_dir, dbs, profiles, db_proxy_username, db_username))
     return db_config_dir, dbs, profiles, db_proxy_username, db_username
@@ -1,5 +1,14 @@
+import os
+import sys
+import logging
+import tempfile
+
+import pytest
+
+import oracle_tools_gui
 from utils import about
-from utils.pom import db_order
+from utils import pom
+from utils.pom import db_order, process_POM
 
 
 def test_about():
@@ -17,6 +26,239 @@ def test_db_order():
     dbs_sorted_actual = sorted(dbs, key=db_order)
     dbs_sorted_expected = ['a', 'b', 'c', 'd']
     assert dbs_sorted_actual == dbs_sorted_expected
+    dbs = ['orcl', 'PRD2', 'acc', 'prd1', 'Dev']
+    dbs_sorted_actual = sorted(dbs, key=db_order)
+    dbs_sorted_expected = ['Dev', 'acc', 'prd1', 'PRD2', 'orcl']
+    assert dbs_sorted_actual == dbs_sorted_expected
+
+
+def test_process_POM_without_maven(monkeypatch, tmp_path):
+    pom.logger = logging.getLogger()
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    db_config_dir = tmp_path / 'conf'
+    for db in ['prd', 'dev']:
+        (db_config_dir / db).mkdir(parents=True)
+    calls = []
+
+    def determine_POM_settings(pom_file, db_config_dir_):
+        calls.append(pom_file)
+        # the parent POM defines db.proxy.username
+        return {'db.config.dir': str(db_config_dir), 'db.proxy.username': 'proxy', 'db.username': 'user'}, {'apex-export', 'apex-import'}
+
+    monkeypatch.setattr(pom, '_determine_POM_settings', determine_POM_settings)
+    pom_file = tmp_path / 'pom.xml'
+    profiles = ''.join(f'<profile><id>{profile}</id></profile>' for profile in ['apex-import', 'apex-export', 'extra'])
+    pom_file.write_text(f'''<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <properties>
+    <db.config.dir>{db_config_dir}</db.config.dir>
+    <db.proxy.username>proxy</db.proxy.username>
+  </properties>
+  <profiles>{profiles}</profiles>
+</project>
+''')
+    actual = process_POM(str(pom_file), None)
+    assert actual[0] == str(db_config_dir)
+    assert sorted(actual[1]) == ['dev', 'prd']
+    assert actual[2:] == (['apex-export', 'apex-import'], 'proxy', '')
+    assert calls == []
+
+    # with a parent POM Maven must be used, even though the POM itself seems to suffice
+    pom_file.write_text(f'''<?xml version="1.0" encoding="UTF-8"?>
+<project xmlns="http://maven.apache.org/POM/4.0.0">
+  <parent>
+    <groupId>com.paulissoft.pato</groupId>
+    <artifactId>oracle-tools</artifactId>
+    <version>1.0.0</version>
+  </parent>
+  <properties>
+    <db.config.dir>{db_config_dir}</db.config.dir>
+    <db.username>user</db.username>
+  </properties>
+  <profiles>{profiles}</profiles>
+</project>
+''')
+    actual = process_POM(str(pom_file), None)
+    assert actual[2:] == (['apex-export', 'apex-import'], 'proxy', 'user')
+    assert calls == [str(pom_file)]
+
+
+FAKE_MVN = """#!{python}
+import os
+import sys
+
+with open(os.environ['FAKE_MVN_STDOUT'], 'rb') as fp:
+    sys.stdout.buffer.write(fp.read())
+if os.environ.get('FAKE_MVN_ERROR'):
+    sys.stderr.write(os.environ['FAKE_MVN_ERROR'])
+    sys.exit(1)
+"""
+
+
+def test_determine_POM_settings(monkeypatch, tmp_path):
+    pom.logger = logging.getLogger()
+    mvn = tmp_path / 'mvn'
+    mvn.write_text(FAKE_MVN.format(python=sys.executable))
+    mvn.chmod(0o755)
+    stdout = tmp_path / 'stdout'
+    stdout.write_bytes(b'[INFO] Scanning for projects...\n'
+                       b'  Profile Id: db-info (Active: false , Source: pom)\r\n'
+                       b'  Profile Id: conf-inquiry (Active: true , Source: pom)\n'
+                       b'[echoproperties] db.config.dir=C\\:\\\\dev\\\\conf\r\n'
+                       b'[echoproperties] db.url=jdbc:oracle:thin:@//host:1521/orcl?a=b\n'
+                       b'[echoproperties] db.empty=\n'
+                       b'[INFO] BUILD SUCCESS')
+    monkeypatch.setattr(pom, 'which', lambda program: str(mvn))
+    monkeypatch.setenv('FAKE_MVN_STDOUT', str(stdout))
+    monkeypatch.delenv('FAKE_MVN_ERROR', raising=False)
+    properties, profiles = pom._determine_POM_settings('pom.xml', None)
+    assert properties == {'db.config.dir': 'C\\:\\\\dev\\\\conf', 'db.url': 'jdbc:oracle:thin:@//host:1521/orcl?a=b'}
+    assert profiles == {'db-info', 'conf-inquiry'}
+    monkeypatch.setenv('FAKE_MVN_ERROR', 'Could not resolve the parent POM')
+    with pytest.raises(Exception, match='failed with return code 1 and error:\nCould not resolve the parent POM'):
+        pom._determine_POM_settings('pom.xml', None)
+
+
+def setup_cached_POM(monkeypatch, tmp_path):
+    """
+    Setup a POM file that needs Maven (fake) and a private temporary directory for the cache.
+    Returns the POM file and the list of Maven calls.
+    """
+    pom.logger = logging.getLogger()
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.delenv(pom.NO_CACHE, raising=False)
+    db_config_dir = tmp_path / 'conf'
+    (db_config_dir / 'dev').mkdir(parents=True)
+    pom_file = tmp_path / 'pom.xml'
+    pom_file.write_text('<project xmlns="http://maven.apache.org/POM/4.0.0"/>')
+    calls = []
+
+    def determine_POM_settings(pom_file, db_config_dir_):
+        calls.append(pom_file)
+        return {'db.config.dir': str(db_config_dir), 'db.proxy.username': 'proxy'}, {'apex-export', 'apex-import'}
+
+    monkeypatch.setattr(pom, '_determine_POM_settings', determine_POM_settings)
+    return pom_file, calls
+
+
+def test_read_write_cache(monkeypatch, tmp_path):
+    pom.logger = logging.getLogger()
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.delenv(pom.NO_CACHE, raising=False)
+    with pytest.raises(OSError):
+        pom._read_cache('key')
+    pom._write_cache('key', {'a': [1, 2]})
+    assert pom._read_cache('key') == {'a': [1, 2]}
+    assert pom._cache_file('key').parent == pom._cache_dir()
+    assert pom._cache_dir().parent == tmp_path
+    monkeypatch.setenv(pom.NO_CACHE, '1')
+    with pytest.raises(OSError):
+        pom._read_cache('key')
+
+
+def test_process_POM_cache(monkeypatch, tmp_path):
+    pom_file, calls = setup_cached_POM(monkeypatch, tmp_path)
+    expected = (str(tmp_path / 'conf'), ['dev'], ['apex-export', 'apex-import'], 'proxy', '')
+    assert process_POM(str(pom_file), None) == expected
+    assert len(calls) == 1
+    # a hit skips Maven
+    assert process_POM(str(pom_file), None) == expected
+    assert len(calls) == 1
+    # a changed modification time runs Maven again
+    st = os.stat(pom_file)
+    os.utime(pom_file, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    assert process_POM(str(pom_file), None) == expected
+    assert len(calls) == 2
+    # a cache file that is not a dict falls back to Maven
+    cache_files = list(pom._cache_dir().glob('*.json'))
+    assert len(cache_files) == 2
+    for cache_file in cache_files:
+        cache_file.write_text('[]')
+    assert process_POM(str(pom_file), None) == expected
+    assert len(calls) == 3
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='Unix permissions only')
+def test_process_POM_cache_dir_refused(monkeypatch, tmp_path):
+    pom_file, calls = setup_cached_POM(monkeypatch, tmp_path)
+    process_POM(str(pom_file), None)
+    cache_dir = pom._cache_dir()
+    for mode in [0o750, 0o707]:
+        cache_dir.chmod(mode)
+        with pytest.raises(PermissionError):
+            pom._cache_dir()
+        calls.clear()
+        process_POM(str(pom_file), None)
+        process_POM(str(pom_file), None)
+        assert len(calls) == 2
+
+
+FAKE_PROGRAM = """#!{python}
+import os
+import sys
+
+with open(os.environ['FAKE_PROGRAM_CALLS'], 'a') as fp:
+    fp.write(os.path.basename(sys.argv[0]) + '\\n')
+print({output!r}, file=sys.stderr if {stderr} else sys.stdout)
+"""
+
+
+def test_check_environment_cache(monkeypatch, tmp_path):
+    pom.logger = logging.getLogger()
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    monkeypatch.delenv(pom.NO_CACHE, raising=False)
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    outputs = {'mvn': ('Apache Maven 3.8.1', False),
+               'perl': ('This is perl 5, version 30, subversion 0 (v5.30.0)', False),
+               'sql': ('SQLcl: Release 21.4.0.0 Production', False),
+               'java': ('openjdk version "11.0.2" 2019-01-15', True),
+               'javac': ('javac 11.0.2', False)}
+    for program, (output, stderr) in outputs.items():
+        script = bin_dir / program
+        script.write_text(FAKE_PROGRAM.format(python=sys.executable, output=output, stderr=stderr))
+        script.chmod(0o755)
+    calls = tmp_path / 'calls'
+    monkeypatch.setenv('FAKE_PROGRAM_CALLS', str(calls))
+    monkeypatch.setenv('PATH', str(bin_dir) + os.pathsep + os.environ['PATH'])
+
+    def ran():
+        programs = sorted(calls.read_text().split()) if calls.exists() else []
+        calls.unlink(missing_ok=True)
+        return programs
+
+    pom.check_environment()
+    assert ran() == sorted(outputs)
+    # the second check uses the cache
+    pom.check_environment()
+    assert ran() == []
+    # an incomplete cache does not count
+    for cache_file in pom._cache_dir().glob('*.json'):
+        cache_file.write_text('[]')
+    pom.check_environment()
+    assert ran() == sorted(outputs)
+    # a replaced program checks again
+    st = os.stat(bin_dir / 'sql')
+    os.utime(bin_dir / 'sql', ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    pom.check_environment()
+    assert ran() == sorted(outputs)
+    pom.check_environment()
+    assert ran() == []
+
+
+def test_main_run_POM_file(monkeypatch):
+    commands = []
+    monkeypatch.setattr(oracle_tools_gui, 'which', lambda program: f'/opt/{program}/bin/{program}')
+    monkeypatch.setattr(oracle_tools_gui.subprocess, 'run', lambda cmd, check: commands.append(cmd))
+    monkeypatch.setenv('DB_PASSWORD', '')
+    # the command line of the Maven run as supplied by Gooey
+    monkeypatch.setattr(sys, 'argv', ['oracle_tools_gui.py', '--ignore-gooey',
+                                      '--db', 'dev', '--db-proxy-password', 'secret',
+                                      '--action', 'db-info', '--extra-maven-command-line-options', r'-X -Dfoo="a b" -Ddir=C:\dev\conf#1',
+                                      '--file', '/p/pom.xml', '--db-config-dir', '/p/conf'])
+    oracle_tools_gui.main()
+    assert commands == [['/opt/mvn/bin/mvn', '--file', '/p/pom.xml', '-Pdb-info', '-Ddb.config.dir=/p/conf', '-Ddb=dev',
+                         '-X', '-Dfoo=a b', r'-Ddir=C:\dev\conf#1', '-Dsql.home=/opt/sql']]
 
 
 if __name__ == '__main__':